@@ -21,6 +21,7 @@ Version=2
 
 import os
 import sys
+from functools import lru_cache
 
 if os.name == "nt" or sys.platform == "darwin":
     from quodlibet.plugins import PluginNotSupportedError
@@ -43,12 +44,18 @@ def get_gs_provider_files():
     """Return all installed search provider files for GNOME Shell"""
 
     ini_files = []
+    seen = set()
     for d in xdg_get_system_data_dirs():
         path = os.path.join(d, "gnome-shell", "search-providers")
+        # XDG_DATA_DIRS often lists the same directory more than once
+        if path in seen:
+            continue
+        seen.add(path)
         try:
-            for entry in os.listdir(path):
-                if entry.endswith(".ini"):
-                    ini_files.append(os.path.join(path, entry))
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.name.endswith(".ini"):
+                        ini_files.append(entry.path)
         except EnvironmentError:
             pass
     return ini_files
@@ -58,11 +65,11 @@ def check_ini_installed():
     """Raise if no GNOME Shell ini file for Quod Libet is found"""
 
     quodlibet_installed = False
+    bus_name = SearchProvider.BUS_NAME.encode("ascii")
     for path in get_gs_provider_files():
         try:
             with open(path, "rb") as handle:
-                data = handle.read().decode("utf-8", "replace")
-                if SearchProvider.BUS_NAME in data:
+                if bus_name in handle.read():
                     quodlibet_installed = True
                     break
         except EnvironmentError:
@@ -93,22 +100,30 @@ class GnomeSearchProvider(EventPlugin):
 
 ENTRY_ICON = (". GThemedIcon audio-mpeg gnome-mime-audio-mpeg "
               "audio-x-generic")
+ENTRY_ICON_VARIANT = GLib.Variant('s', ENTRY_ICON)
+
+
+@lru_cache(maxsize=512)
+def compile_query(term):
+    return Query(term)
 
 
 def get_song_id(song):
     return str(id(song))
 
 
-def get_songs_for_ids(library, ids):
+def get_songs_by_id(library):
+    return {id(song): song for song in library}
+
+
+def get_songs_for_ids(songs_by_id, ids):
     songs = []
-    ids = set(ids)
-    for song in library:
-        song_id = get_song_id(song)
-        if song_id in ids:
-            songs.append(song)
-            ids.discard(song_id)
-            if not ids:
-                break
+    for song_id in ids:
+        try:
+            song = songs_by_id[int(song_id)]
+        except (ValueError, KeyError):
+            continue
+        songs.append(song)
     return songs
 
 
@@ -154,20 +169,51 @@ class SearchProvider:
     BUS_NAME = "io.github.quodlibet.QuodLibet.SearchProvider"
     IFACE = "org.gnome.Shell.SearchProvider2"
 
+    MAX_CACHED_METAS = 512
+
+    _node_info = None
+
     def __init__(self):
         self._own_id = Gio.bus_own_name(Gio.BusType.SESSION, self.BUS_NAME,
                                         Gio.BusNameOwnerFlags.NONE,
                                         self.on_bus_acquired, None,
                                         self.on_name_lost)
         self._registered_ids = []
-        self._method_outargs = {}
+        self._methods = {}
+
+        self._songs_by_id = None
+        self._metas = {}
+        self._library_sigs = [
+            app.library.connect(signal, self.__library_changed)
+            for signal in ("added", "removed")]
+        self._library_sigs.append(
+            app.library.connect("changed", self.__songs_changed))
+
+    def __library_changed(self, library, songs):
+        self._songs_by_id = None
+        self._metas.clear()
+
+    def __songs_changed(self, library, songs):
+        for song in songs:
+            self._metas.pop(id(song), None)
+
+    def _get_songs_for_ids(self, ids):
+        if self._songs_by_id is None:
+            self._songs_by_id = get_songs_by_id(app.library)
+        return get_songs_for_ids(self._songs_by_id, ids)
 
     def on_bus_acquired(self, connection, name):
-        info = Gio.DBusNodeInfo.new_for_xml(self.__doc__)
+        cls = type(self)
+        if cls._node_info is None:
+            cls._node_info = Gio.DBusNodeInfo.new_for_xml(self.__doc__)
+        info = cls._node_info
         for interface in info.interfaces:
             for method in interface.methods:
-                self._method_outargs[method.name] = '({})'.format(
+                out_args = '({})'.format(
                     ''.join([arg.signature for arg in method.out_args]))
+                self._methods[method.name] = (
+                    getattr(self, method.name),
+                    out_args if out_args != '()' else None)
 
             _id = connection.register_object(
                 object_path=self.PATH,
@@ -184,15 +230,20 @@ class SearchProvider:
             Gio.bus_unown_name(self._own_id)
             self._own_id = None
 
+        for sig in self._library_sigs:
+            app.library.disconnect(sig)
+        self._library_sigs = []
+        self._songs_by_id = None
+        self._metas.clear()
+
     def on_method_call(self, connection, sender, object_path, interface_name,
                        method_name, parameters, invocation):
-        args = list(parameters.unpack())
-        result = getattr(self, method_name)(*args)
+        method, out_args = self._methods[method_name]
+        result = method(*parameters.unpack())
         if not isinstance(result, tuple):
             result = (result,)
 
-        out_args = self._method_outargs[method_name]
-        if out_args != '()':
+        if out_args is not None:
             variant = GLib.Variant(out_args, result)
             invocation.return_value(variant)
         else:
@@ -201,46 +252,60 @@ class SearchProvider:
     def Introspect(self):
         return self.__doc__
 
+    def _get_query(self, terms):
+        query = compile_query(terms[0])
+        for term in terms[1:]:
+            query &= compile_query(term)
+        return query
+
     def GetInitialResultSet(self, terms):
-        if terms:
-            query = Query("")
-            for term in terms:
-                query &= Query(term)
-            songs = filter(query.search, app.library)
-        else:
-            songs = app.library.values()
+        if not app.library:
+            return []
 
-        ids = [get_song_id(s) for s in songs]
-        return ids
+        if not terms:
+            return [get_song_id(s) for s in app.library]
+
+        if len(terms) == 1:
+            search = compile_query(terms[0]).search
+        else:
+            search = self._get_query(terms).search
+        return [get_song_id(s) for s in app.library if search(s)]
 
     def GetSubsearchResultSet(self, previous_results, terms):
-        query = Query("")
-        for term in terms:
-            query &= Query(term)
+        songs = self._get_songs_for_ids(previous_results)
+        if not terms:
+            return [get_song_id(s) for s in songs]
 
-        songs = get_songs_for_ids(app.library, previous_results)
-        ids = [get_song_id(s) for s in songs if query.search(s)]
+        search = self._get_query(terms).search
+        ids = [get_song_id(s) for s in songs if search(s)]
         return ids
 
     def GetResultMetas(self, identifiers):
         metas = []
-        for song in get_songs_for_ids(app.library, identifiers):
-            name = song("title")
-            description = song("~artist~title")
-            song_id = get_song_id(song)
-            meta = {
-                "name": GLib.Variant('s', dbus_unicode_validate(name)),
-                "id": GLib.Variant('s', song_id),
-                "description": GLib.Variant(
-                    's', dbus_unicode_validate(description)),
-                "gicon": GLib.Variant('s', ENTRY_ICON)
-            }
+        cache = self._metas
+        validate = dbus_unicode_validate
+        Variant = GLib.Variant
+        for song in self._get_songs_for_ids(identifiers):
+            meta = cache.get(id(song))
+            if meta is None:
+                name = song("title")
+                description = song("~artist~title")
+                song_id = get_song_id(song)
+                meta = {
+                    "name": Variant('s', validate(name)),
+                    "id": Variant('s', song_id),
+                    "description": Variant('s', validate(description)),
+                    "gicon": ENTRY_ICON_VARIANT
+                }
+                if len(cache) >= self.MAX_CACHED_METAS:
+                    cache.clear()
+                cache[id(song)] = meta
             metas.append(meta)
 
         return metas
 
     def ActivateResult(self, identifier, terms, timestamp):
-        songs = get_songs_for_ids(app.library, [identifier])
+        songs = self._get_songs_for_ids([identifier])
         if not songs:
             return
 
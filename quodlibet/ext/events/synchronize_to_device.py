@@ -9,10 +9,12 @@
 
 import os
 import shutil
+import time
 import unicodedata
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 
-from gi.repository import Gtk, Pango
+from gi.repository import GLib, Gtk, Pango
 from senf import fsn2text
 
 from quodlibet import _
@@ -31,6 +33,7 @@ from quodlibet.qltk.cbes import ComboBoxEntrySave
 from quodlibet.qltk.ccb import ConfigCheckButton
 from quodlibet.qltk.views import HintedTreeView
 from quodlibet.query import Query
+from quodlibet.query._match import Union
 from quodlibet.util import print_d, print_e, print_exc
 from quodlibet.util.enum import enum
 from quodlibet.util.path import strip_win32_incompat_from_path
@@ -39,6 +42,78 @@ from quodlibet.util.string.titlecase import human_title
 PLUGIN_CONFIG_SECTION = 'synchronize_to_device'
 
 
+class _CombiningChars(dict):
+    """
+    A str.translate() table which removes combining characters.
+    Characters are looked up the first time they are seen.
+    """
+
+    def __missing__(self, char):
+        value = None if unicodedata.combining(chr(char)) else char
+        self[char] = value
+        return value
+
+
+_COMBINING_CHARS = _CombiningChars()
+
+
+def _clean_path(path):
+    """
+    Remove empty and '.' components from a path, like pathlib does.
+    Unlike os.path.normpath(), '..' components are kept, so that a tag value
+    of '..' is made safe instead of changing the folder the path points to.
+    """
+    if os.altsep:
+        path = path.replace(os.altsep, os.sep)
+    parts = path.split(os.sep)
+    kept = [part for part in parts[1:] if part not in ('', '.')]
+    if len(kept) == len(parts) - 1:
+        return path
+    return os.sep.join([parts[0]] + kept) or os.sep
+
+
+def _copy_file_range(src, dst):
+    """
+    Copy the contents of a file inside the kernel, without passing the data
+    through user space. Raises OSError if this isn't supported, or if it
+    didn't copy the whole file.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        src_fd = fsrc.fileno()
+        dst_fd = fdst.fileno()
+        size = os.fstat(src_fd).st_size
+        copied = 0
+        while True:
+            n_bytes = os.copy_file_range(src_fd, dst_fd, 1 << 30)
+            if not n_bytes:
+                break
+            copied += n_bytes
+
+    # Some file systems report no data at all (e.g. procfs, some FUSE
+    # mounts), so don't trust an empty or short copy
+    if not copied or copied < size:
+        raise OSError('copy_file_range() copied {} of {} bytes'.format(
+            copied, size))
+
+
+def _copy_file(src, dst):
+    """
+    Copy the contents of the file `src` to `dst`.
+    Uses os.copy_file_range() where available, which allows the file system to
+    do the copy itself (e.g. reflinks or server-side copies). Otherwise falls
+    back to shutil.copyfile(), which uses os.sendfile() on Linux.
+    """
+    if hasattr(os, 'copy_file_range'):
+        try:
+            _copy_file_range(src, dst)
+            return
+        except OSError:
+            # e.g. copying across file systems on older kernels or a short
+            # copy, let shutil report any other errors
+            pass
+    shutil.copyfile(src, dst)
+
+
 class Entry:
     """
     An entry in the tree of previewed export paths.
@@ -61,6 +136,8 @@ class Entry:
         RESULT_FAILURE = _('FAILURE')
         RESULT_SKIP_EXISTING = _('Skipped existing file')
 
+    __slots__ = ('_song', 'export_path', 'tag', '_filename')
+
     def __init__(self, song, export_path=None):
         self._song = song
         self.export_path = export_path or ''
@@ -69,10 +146,9 @@ class Entry:
 
     @property
     def filename(self):
-        if self._song is not None:
-            return fsn2text(self._song('~filename'))
-        else:
-            return self._filename
+        if self._filename is None and self._song is not None:
+            self._filename = fsn2text(self._song('~filename'))
+        return self._filename
 
     @filename.setter
     def filename(self, name):
@@ -111,19 +187,53 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
                   'filename': (2, str),
                   'export': (3, str)}
 
-    def PluginPreferences(self, parent):
-        # Check if the queries file exists
-        if not os.path.exists(self.path_query):
-            return self._no_queries_frame()
+    # The parsed saved searches, with the queries file state they came from
+    _saved_queries = (None, {})
+    _compiled_queries = {}
+
+    # Whether an update of the sync summary is waiting for the main loop
+    _sync_summary_queued = False
+
+    # The songs selected by the last preview, with the library and the
+    # queries they were selected with. Only kept while the plugin is enabled.
+    _selected_songs = None
+    _library_tracked = False
+
+    # Number of songs to process between two UI updates
+    batch_size = 256
+
+    # Seconds between two UI updates while synchronizing
+    events_interval = 0.05
+
+    # Number of files to copy at the same time
+    copy_workers = 4
+
+    # Number of empty directories to remove at the same time
+    remove_workers = 16
+
+    def enabled(self):
+        # Library changes are only reported to enabled plugins
+        self._library_tracked = True
+        self._selected_songs = None
+
+    def disabled(self):
+        self._library_tracked = False
+        self._selected_songs = None
+
+    def plugin_on_added(self, songs):
+        self._selected_songs = None
+
+    def plugin_on_changed(self, songs):
+        self._selected_songs = None
 
+    def plugin_on_removed(self, songs):
+        self._selected_songs = None
+
+    def PluginPreferences(self, parent):
         # Read saved searches from file
-        self.queries = {}
-        with open(self.path_query, 'r', encoding='utf-8') as query_file:
-            for query_string in query_file:
-                name = next(query_file).strip()
-                self.queries[name] = Query(query_string.strip())
+        self.queries = self._read_saved_queries()
         if not self.queries:
-            # query_file is empty
+            # query_file is missing or empty
             return self._no_queries_frame()
 
         main_vbox = Gtk.VBox(spacing=self.spacing_main)
@@ -132,7 +242,7 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
         # Saved search selection frame
         saved_search_vbox = Gtk.VBox(spacing=self.spacing_large)
         self.saved_search_vbox = saved_search_vbox
-        for query_name, query in self.queries.items():
+        for query_name in self.queries:
             query_config = self.CONFIG_QUERY_PREFIX + query_name
             check_button = ConfigCheckButton(query_name, PM.CONFIG_SECTION,
                                              self._config_key(query_config))
@@ -215,7 +325,9 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
         # Details view
         column_types = [column[1] for column in self.model_cols.values()]
         self.model = Gtk.ListStore(*column_types)
+        self._path_counts = {}
         self.details_tree = details_tree = HintedTreeView(model=self.model)
+        details_tree.set_fixed_height_mode(True)
         details_scroll = self._expandable_scroll()
         details_scroll.set_shadow_type(Gtk.ShadowType.IN)
         details_scroll.add(details_tree)
@@ -223,25 +335,24 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
 
         # Preview column: status
         render = Gtk.CellRendererText()
-        column = self._tree_view_column(render, self._cdf_status,
+        column = self._tree_view_column(render, self._model_col_id('tag'),
                                         title=_('Status'), expand=False,
-                                        sort=self._model_col_id('tag'))
+                                        width=150)
         details_tree.append_column(column)
 
         # Preview column: file
         render = Gtk.CellRendererText()
-        column = self._tree_view_column(render, self._cdf_source_path,
-                                        title=_('Source File'),
-                                        sort=self._model_col_id('filename'))
+        column = self._tree_view_column(render,
+                                        self._model_col_id('filename'),
+                                        title=_('Source File'))
         details_tree.append_column(column)
 
         # Preview column: export path
         render = Gtk.CellRendererText()
         render.set_property('editable', True)
         render.connect('edited', self._row_edited)
-        column = self._tree_view_column(render, self._cdf_export_path,
-                                        title=_('Export Path'),
-                                        sort=self._model_col_id('export'))
+        column = self._tree_view_column(render, self._model_col_id('export'),
+                                        title=_('Export Path'))
         details_tree.append_column(column)
 
         # Status labels
@@ -292,6 +403,43 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
 
         return main_vbox
 
+    def _read_saved_queries(self):
+        """
+        Read the saved searches from the queries file. The query strings are
+        reused until the file changes, and are only compiled once selected
+        for synchronization.
+
+        :return: A dictionary of query names to query strings.
+        """
+        try:
+            stat = os.stat(self.path_query)
+        except FileNotFoundError:
+            return {}
+        key = (self.path_query, stat.st_mtime_ns, stat.st_size)
+        cached_key, queries = SyncToDevice._saved_queries
+        if key != cached_key:
+            with open(self.path_query, 'r', encoding='utf-8') as query_file:
+                lines = query_file.read().split('\n')
+            queries = {name.strip(): query_string.strip()
+                       for query_string, name in zip(lines[::2], lines[1::2])}
+            SyncToDevice._saved_queries = (key, queries)
+            SyncToDevice._compiled_queries = {}
+        return queries
+
+    @staticmethod
+    def _compile_query(query_string):
+        """
+        Get the Query object for a saved search, compiling it on first use.
+
+        :param query_string: The query string from the queries file.
+        :return: The compiled Query.
+        """
+        query = SyncToDevice._compiled_queries.get(query_string)
+        if query is None:
+            query = Query(query_string)
+            SyncToDevice._compiled_queries[query_string] = query
+        return query
+
     @staticmethod
     def _no_queries_frame():
         """
@@ -336,22 +484,25 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
 
         return hbox
 
-    def _tree_view_column(self, render, cdf, title=None, sort=None,
-                          expand=True, resize=True, reorder=True):
+    def _tree_view_column(self, render, model_col, title=None,
+                          expand=True, resize=True, reorder=True, width=50):
         """
         Create a new TreeViewColumn with the given properties.
-
-        :param render:  The A Gtk.CellRenderer of this cell.
-        :param cdf:     The Gtk.TreeCellDataFunc to use for updating content.
-        :param title:   The column's title.
-        :param sort:    The model column to use when sorting this column.
-        :param expand:  Whether the column width should automatically expand.
-        :param resize:  Whether the column can be resized.
-        :param reorder: Whether the column can be reordered.
+        The column has a fixed width, so that adding rows doesn't require
+        measuring the content of all rows again.
+
+        :param render:    The A Gtk.CellRenderer of this cell.
+        :param model_col: The model column to show and to sort this column by.
+        :param title:     The column's title.
+        :param expand:    Whether the column width should automatically expand.
+        :param resize:    Whether the column can be resized.
+        :param reorder:   Whether the column can be reordered.
+        :param width:     The initial width of the column.
         :return: The new TreeViewColumn.
         """
         tvc = Gtk.TreeViewColumn()
-        tvc.set_sizing(Gtk.TreeViewColumnSizing.AUTOSIZE)
+        tvc.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        tvc.set_fixed_width(width)
         tvc.set_expand(expand)
         tvc.set_resizable(resize)
         tvc.set_reorderable(reorder)
@@ -359,10 +510,9 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
             tvc.set_title(title)
         if resize:
             render.set_property('ellipsize', Pango.EllipsizeMode.END)
-        if sort:
-            tvc.set_sort_column_id(sort)
-        tvc.set_cell_data_func(render, cdf)
+        tvc.set_sort_column_id(model_col)
         tvc.pack_start(render, True)
+        tvc.add_attribute(render, 'text', model_col)
         self.renders[tvc] = render
         return tvc
 
@@ -416,24 +566,6 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
         """
         config.set(PM.CONFIG_SECTION, self.CONFIG_PATTERN_KEY, entry.get_text())
 
-    def _cdf_status(self, column, cell, model, iter_, data):
-        """
-        Handle entering data into the "Status" column of the sync previews.
-        """
-        cell.set_property('text', model[iter_][self._model_col_id('tag')])
-
-    def _cdf_source_path(self, column, cell, model, iter_, data):
-        """
-        Handle entering data into the "File" column of the sync previews.
-        """
-        cell.set_property('text', model[iter_][self._model_col_id('filename')])
-
-    def _cdf_export_path(self, column, cell, model, iter_, data):
-        """
-        Handle entering data into the "Export" column of the sync previews.
-        """
-        cell.set_property('text', model[iter_][self._model_col_id('export')])
-
     def _row_edited(self, renderer, path, entered_path):
         """
         Handle a manual edit of a previewed export path.
@@ -443,46 +575,6 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
         :param entered_path:    The new path entered by the user.
         """
 
-        def _update_warnings():
-            """
-            Toggle the visibility of the status warning labels based on the song
-            counts.
-            """
-            if self.c_song_dupes == 0:
-                self.status_duplicates.set_visible(False)
-            else:
-                self.status_duplicates.set_visible(True)
-
-            if self.c_songs_delete == 0:
-                self.status_deletions.set_visible(False)
-            else:
-                self.status_deletions.set_visible(True)
-
-        def _make_duplicate(entry, old_unique):
-            """ Mark the given entry as a duplicate. """
-            print_d(entry.filename)
-            entry.tag = Entry.Tags.SKIP_DUPLICATE
-            self.c_song_dupes += 1
-            if old_unique:
-                self.c_songs_copy -= 1
-            _update_warnings()
-
-        def _make_unique(entry, old_duplicate):
-            """ Mark the given entry as a unique file. """
-            print_d(entry.filename)
-            entry.tag = Entry.Tags.PENDING_COPY
-            self.c_songs_copy += 1
-            if old_duplicate:
-                self.c_song_dupes -= 1
-            _update_warnings()
-
-        def _make_skip(entry, counter):
-            """ Skip the given entry during synchronization. """
-            print_d(entry.filename)
-            entry.tag = Entry.Tags.SKIP
-            entry.export_path = ''
-            return counter - 1
-
         def _update_other_song(model, path, iter_, *data):
             """
             Update a previewed path based on the current change.
@@ -498,12 +590,12 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
                 pass
             elif model_entry.export_path == entered_path \
                     and model_entry.tag == Entry.Tags.PENDING_COPY:
-                _make_duplicate(model_entry, True)
+                self._make_duplicate(model_entry, True)
                 self._update_model_value(iter_, 'tag', model_entry.tag)
             elif model_entry.tag == Entry.Tags.SKIP_DUPLICATE \
                     and model_entry.export_path != entered_path \
-                    and self._get_paths()[model_entry.export_path] == 1:
-                _make_unique(model_entry, True)
+                    and self._path_counts[model_entry.export_path] == 1:
+                self._make_unique(model_entry, True)
                 self._update_model_value(iter_, 'tag', model_entry.tag)
             return False
 
@@ -511,6 +603,8 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
         entry = self.model[path][self._model_col_id('entry')]
         if entry.export_path != entered_path:
             old_path, new_path = {}, {}
+            update_other_songs = False
+            self._count_export_path(entry, -1)
 
             old_path['duplicate'] = entry.tag == Entry.Tags.SKIP_DUPLICATE
             old_path['delete'] = entry.tag == Entry.Tags.PENDING_DELETE
@@ -522,9 +616,7 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
             for key, value in old_path.items():
                 old_path_inv.setdefault(value, []).append(key)
 
-            previewed_paths = self._get_paths().keys()
-
-            new_path['duplicate'] = entered_path in previewed_paths
+            new_path['duplicate'] = entered_path in self._path_counts
             new_path['delete'] = entered_path.lower() == Entry.Tags.DELETE
             new_path['empty'] = not entered_path and not new_path['delete']
             new_path['unique'] = not (new_path['duplicate']
@@ -548,22 +640,23 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
                     Path(entry.filename).relative_to(self.expanded_destination)
                     entry.tag = Entry.Tags.PENDING_DELETE
                     self.c_songs_delete += 1
-                    _update_warnings()
+                    self._update_warnings()
                 except ValueError:
                     pass
             elif old_path['empty'] and new_path['duplicate']:
-                _make_duplicate(entry, False)
+                self._make_duplicate(entry, False)
                 entry.export_path = entered_path
             elif old_path['empty'] and new_path['unique']:
-                _make_unique(entry, False)
+                self._make_unique(entry, False)
                 entry.export_path = entered_path
 
             # If the old path was a deletion...
             elif old_path['delete'] and new_path['empty']:
                 pass
             elif old_path['delete'] and new_path['delete']:
-                self.c_songs_delete = _make_skip(entry, self.c_songs_delete)
-                _update_warnings()
+                self.c_songs_delete = self._make_skip(entry,
+                                                      self.c_songs_delete)
+                self._update_warnings()
             elif old_path['delete'] and new_path['duplicate']:
                 pass
             elif old_path['delete'] and new_path['unique']:
@@ -571,34 +664,43 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
 
             # If the old path was a duplicate...
             elif old_path['duplicate'] and new_path['empty']:
-                self.c_song_dupes = _make_skip(entry, self.c_song_dupes)
-                self.model.foreach(_update_other_song)
-                _update_warnings()
+                self.c_song_dupes = self._make_skip(entry,
+                                                    self.c_song_dupes)
+                update_other_songs = True
+                self._update_warnings()
             elif old_path['duplicate'] and new_path['delete']:
-                self.c_song_dupes = _make_skip(entry, self.c_song_dupes)
-                self.model.foreach(_update_other_song)
-                _update_warnings()
+                self.c_song_dupes = self._make_skip(entry,
+                                                    self.c_song_dupes)
+                update_other_songs = True
+                self._update_warnings()
             elif old_path['duplicate'] and new_path['duplicate']:
                 entry.export_path = entered_path
             elif old_path['duplicate'] and new_path['unique']:
-                _make_unique(entry, True)
+                self._make_unique(entry, True)
                 entry.export_path = entered_path
-                self.model.foreach(_update_other_song)
+                update_other_songs = True
 
             # If the old path was unique...
             elif old_path['unique'] and new_path['empty']:
-                self.c_songs_copy = _make_skip(entry, self.c_songs_copy)
-                self.model.foreach(_update_other_song)
-                _update_warnings()
+                self.c_songs_copy = self._make_skip(entry,
+                                                    self.c_songs_copy)
+                update_other_songs = True
+                self._update_warnings()
             elif old_path['unique'] and new_path['delete']:
-                self.c_songs_copy = _make_skip(entry, self.c_songs_copy)
-                self.model.foreach(_update_other_song)
-                _update_warnings()
+                self.c_songs_copy = self._make_skip(entry,
+                                                    self.c_songs_copy)
+                update_other_songs = True
+                self._update_warnings()
             elif old_path['unique'] and new_path['duplicate']:
-                _make_duplicate(entry, True)
+                self._make_duplicate(entry, True)
                 entry.export_path = entered_path
             elif old_path['unique'] and new_path['unique']:
                 entry.export_path = entered_path
+                update_other_songs = True
+
+            # Update the other previewed paths after the current change
+            self._count_export_path(entry, 1)
+            if update_other_songs:
                 self.model.foreach(_update_other_song)
 
             # Update the model and the summary field
@@ -606,6 +708,47 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
                                self._make_model_row(entry))
             self._update_preview_summary()
 
+    def _update_warnings(self):
+        """
+        Toggle the visibility of the status warning labels based on the song
+        counts.
+        """
+        if self.c_song_dupes == 0:
+            self.status_duplicates.set_visible(False)
+        else:
+            self.status_duplicates.set_visible(True)
+
+        if self.c_songs_delete == 0:
+            self.status_deletions.set_visible(False)
+        else:
+            self.status_deletions.set_visible(True)
+
+    def _make_duplicate(self, entry, old_unique):
+        """ Mark the given entry as a duplicate. """
+        print_d(entry.filename)
+        entry.tag = Entry.Tags.SKIP_DUPLICATE
+        self.c_song_dupes += 1
+        if old_unique:
+            self.c_songs_copy -= 1
+        self._update_warnings()
+
+    def _make_unique(self, entry, old_duplicate):
+        """ Mark the given entry as a unique file. """
+        print_d(entry.filename)
+        entry.tag = Entry.Tags.PENDING_COPY
+        self.c_songs_copy += 1
+        if old_duplicate:
+            self.c_song_dupes -= 1
+        self._update_warnings()
+
+    @staticmethod
+    def _make_skip(entry, counter):
+        """ Skip the given entry during synchronization. """
+        print_d(entry.filename)
+        entry.tag = Entry.Tags.SKIP
+        entry.export_path = ''
+        return counter - 1
+
     def _update_model_value(self, iter_, column, value):
         """
         Set the data in a since cell of the ListStore model.
@@ -634,6 +777,16 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
         """
         return [entry, entry.tag, entry.filename, entry.export_path]
 
+    def _append_model_rows(self, rows):
+        """
+        Append the given rows to the ListStore model and empty the list.
+
+        :param rows: A list of rows created by `_make_model_row`.
+        """
+        for row in rows:
+            self.model.append(row=row)
+        del rows[:]
+
     @staticmethod
     def _run_pending_events():
         """
@@ -703,53 +856,81 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
         if None in {destination_path, pattern}:
             return False
         self.expanded_destination = os.path.expanduser(destination_path)
+        self._destination_prefix = os.path.join(
+            _clean_path(self.expanded_destination), '')
+        self._safe_dirs = {}
 
         # Get a list containing all songs to export
         songs = self._get_songs_from_queries()
         if not songs:
             return False
         self.model.clear()
-        export_paths = []
+        self._path_counts = {}
+        export_paths = set()
 
-        for song in songs:
+        # The relative paths are already normalized, so joining them to the
+        # destination only needs a string concatenation
+        export_prefix = os.path.join(destination_path, '')
+        expanded_prefix = os.path.join(self.expanded_destination, '')
+
+        # Build the export paths one batch at a time, keeping the
+        # application responsive between batches
+        for start in range(0, len(songs), self.batch_size):
+            self._run_pending_events()
             if not self.running:
                 print_d(_('Stopped synchronization preview'))
                 return None
-            self._run_pending_events()
             if not self.destination_entry.get_text():
                 print_d(_('A different plugin was selected - stop preview'))
                 return False
 
-            export_path = self._get_export_path(song, destination_path, pattern)
-            if not export_path:
-                return False
-
-            entry = Entry(song, export_path)
-
-            expanded_path = os.path.expanduser(export_path)
-            if expanded_path in export_paths:
-                entry.tag = Entry.Tags.SKIP_DUPLICATE
-                self.c_song_dupes += 1
-            else:
-                entry.tag = Entry.Tags.PENDING_COPY
-                self.c_songs_copy += 1
-                export_paths.append(expanded_path)
+            batch = songs[start:start + self.batch_size]
+            rows = []
+            for song, (new_name, relative_path) in zip(
+                    batch, self._get_export_paths(batch, pattern)):
+                if relative_path is None:
+                    self._append_model_rows(rows)
+                    self._show_path_mismatch_error(new_name)
+                    return False
+
+                entry = Entry(song, export_prefix + relative_path)
+
+                expanded_path = expanded_prefix + relative_path
+                if expanded_path in export_paths:
+                    entry.tag = Entry.Tags.SKIP_DUPLICATE
+                    self.c_song_dupes += 1
+                else:
+                    entry.tag = Entry.Tags.PENDING_COPY
+                    self.c_songs_copy += 1
+                    export_paths.add(expanded_path)
 
-            self.model.append(row=self._make_model_row(entry))
+                self._count_export_path(entry, 1)
+                rows.append(self._make_model_row(entry))
+            self._append_model_rows(rows)
 
         # List files to delete
-        for root, __, files in os.walk(self.expanded_destination):
-            for name in files:
-                file_path = os.path.join(root, name)
-                if file_path not in export_paths:
-                    entry = Entry(None)
-                    entry.filename = file_path
-                    entry.tag = Entry.Tags.PENDING_DELETE
-                    self.model.append(row=self._make_model_row(entry))
-                    self.c_songs_delete += 1
+        rows = []
+        for file_path in sorted(self._get_destination_files() - export_paths):
+            entry = Entry(None)
+            entry.filename = file_path
+            entry.tag = Entry.Tags.PENDING_DELETE
+            rows.append(self._make_model_row(entry))
+            self.c_songs_delete += 1
+        self._append_model_rows(rows)
 
         return True
 
+    def _get_destination_files(self):
+        """
+        List all files in the destination path.
+
+        :return: A set of the paths of all files in the destination path.
+        """
+        files = set()
+        for root, __, names in os.walk(self.expanded_destination):
+            files.update(os.path.join(root, name) for name in names)
+        return files
+
     def _update_preview_summary(self):
         """
         Update the preview summary text field.
@@ -788,20 +969,20 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
             self.status_progress.set_visible(True)
             print_d(preview_progress_text)
 
-    def _get_paths(self):
+    def _count_export_path(self, entry, step):
         """
-        Build a list of all current export paths for the songs to be
-        synchronized.
+        Update the number of previewed songs using the export path of an
+        entry, if the entry will be synchronized.
+
+        :param entry: The Entry being added to or removed from the counts.
+        :param step:  1 if the entry is being added, -1 if removed.
         """
-        paths = {}
-        for row in self.model:
-            entry = row[self._model_col_id('entry')]
-            if entry.tag != Entry.Tags.PENDING_DELETE and entry.export_path:
-                if entry.export_path not in paths.keys():
-                    paths[entry.export_path] = 1
-                else:
-                    paths[entry.export_path] += 1
-        return paths
+        if entry.tag != Entry.Tags.PENDING_DELETE and entry.export_path:
+            count = self._path_counts.get(entry.export_path, 0) + step
+            if count:
+                self._path_counts[entry.export_path] = count
+            else:
+                del self._path_counts[entry.export_path]
 
     def _show_sync_error(self, title, message):
         """
@@ -852,6 +1033,16 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
 
         return destination_path, pattern
 
+    @staticmethod
+    def _depends_on_time(query):
+        """
+        Check whether the results of a query can change without the library
+        changing, e.g. `#(added < 7 days)` or a plugin query.
+
+        :param query: The Query to check.
+        """
+        return '#(' in query.string or '@(' in query.string
+
     def _get_songs_from_queries(self):
         """
         Build a list of songs to be synchronized, filtered using the
@@ -860,20 +1051,32 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
         :return: A list of the selected songs.
         """
         enabled_queries = []
-        for query_name, query in self.queries.items():
+        for query_name, query_string in self.queries.items():
             query_config = self.CONFIG_QUERY_PREFIX + query_name
             if self.config_get_bool(query_config):
-                enabled_queries.append(query)
+                enabled_queries.append(self._compile_query(query_string))
 
         if not enabled_queries:
             self._show_sync_error(_('No saved searches selected'),
                                   _('Please select at least one saved search.'))
             return []
 
-        selected_songs = []
-        for song in app.library.itervalues():
-            if any(query.search(song) for query in enabled_queries):
-                selected_songs.append(song)
+        # Reuse the songs from the last preview if nothing has changed
+        cached = self._selected_songs
+        if cached and cached[0] is app.library \
+                and cached[1] == enabled_queries:
+            selected_songs = cached[2]
+        else:
+            # Match all selected saved searches in one pass over the library
+            combined_query = Union(
+                [query._unpack() for query in enabled_queries])
+            selected_songs = list(filter(combined_query.search,
+                                         app.library.itervalues()))
+            if self._library_tracked and not any(
+                    self._depends_on_time(query)
+                    for query in enabled_queries):
+                self._selected_songs = (app.library, enabled_queries,
+                                        selected_songs)
 
         if not selected_songs:
             self._show_sync_error(_('No songs in the selected saved searches'),
@@ -883,44 +1086,71 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
         print_d(_('Found {} songs to synchronize').format(len(selected_songs)))
         return selected_songs
 
-    def _get_export_path(self, song, destination_path, export_pattern):
+    def _get_export_paths(self, songs, export_pattern):
         """
-        Use the given pattern of song tags to build the destination path
-        for a song.
+        Use the given pattern of song tags to build the destination paths
+        for some songs.
 
-        :param song:             The song for which to build the export path.
-        :param destination_path: The user-entered destination path.
-        :param export_pattern:   An fsnative file path pattern.
-        :return: A safe full destination path for the song.
+        :param songs:          The songs for which to build the export paths.
+        :param export_pattern: An fsnative file path pattern.
+        :return: A list with a tuple for each song, containing the full path
+                 built from the pattern and a safe destination path relative
+                 to the destination path. The latter is None if the full path
+                 isn't inside the destination path.
         """
-        new_name = Path(export_pattern.format(song))
+        prefix = self._destination_prefix
+        prefix_len = len(prefix)
+        safe_dirs = self._safe_dirs
+        paths = []
+        for song in songs:
+            new_name = _clean_path(export_pattern.format(song))
+            if new_name.startswith(prefix):
+                # Many songs share their artist and album folders, so only
+                # the file name usually needs to be made safe
+                dirname, sep, basename = \
+                    new_name[prefix_len:].rpartition(os.sep)
+                safe_dirname = safe_dirs.get(dirname)
+                if safe_dirname is None:
+                    safe_dirname = self._make_safe_name(dirname)
+                    safe_dirs[dirname] = safe_dirname
+                relative_path = \
+                    safe_dirname + sep + self._make_safe_name(basename)
+            else:
+                relative_path = None
+            paths.append((new_name, relative_path))
+        return paths
 
-        try:
-            relative_name = new_name.relative_to(self.expanded_destination)
-        except ValueError as ex:
-            self._show_sync_error(
-                _('Mismatch between destination path and export '
-                  'pattern'),
-                _('The export pattern starts with a path that '
-                  'differs from the destination path. Please '
-                  'correct the pattern.\n\nError:\n{}').format(ex))
-            return None
+    def _show_path_mismatch_error(self, new_name):
+        """
+        Show an error for an export path outside the destination path.
 
-        return os.path.join(destination_path,
-                            self._make_safe_name(relative_name))
+        :param new_name: The full path built from the export pattern.
+        """
+        error = '{!r} does not start with {!r}'.format(
+            new_name, self._destination_prefix)
+        self._show_sync_error(
+            _('Mismatch between destination path and export '
+              'pattern'),
+            _('The export pattern starts with a path that '
+              'differs from the destination path. Please '
+              'correct the pattern.\n\nError:\n{}').format(error))
 
     def _make_safe_name(self, input_path):
         """
         Make a file path safe by replacing unsafe characters.
 
-        :param input_path: A relative Path.
+        :param input_path: A relative path.
         :return: The given path, with any unsafe characters replaced.
-                 Returned as a string.
         """
-        # Remove diacritics (accents)
-        safe_filename = unicodedata.normalize('NFKD', str(input_path))
-        safe_filename = u''.join(
-            [c for c in safe_filename if not unicodedata.combining(c)])
+        safe_filename = input_path
+        try:
+            # ASCII-only paths have no diacritics and don't change when
+            # normalized, so skip the per-character work for them
+            safe_filename.encode('ascii')
+        except UnicodeEncodeError:
+            # Remove diacritics (accents)
+            safe_filename = unicodedata.normalize('NFKD', safe_filename)
+            safe_filename = safe_filename.translate(_COMBINING_CHARS)
 
         if os.name != "nt":
             # Ensure that Win32-incompatible chars are always removed.
@@ -989,11 +1219,24 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
         """
         self.c_files_copy = self.c_files_skip = self.c_files_skip_previous \
             = self.c_files_dupes = self.c_files_delete = self.c_files_failed = 0
-        self.model.foreach(self._sync_entry)
-        if not self.running:
-            return False
-        self._remove_empty_dirs()
-        return True
+        self._copy_futures = {}
+        self._copy_targets = {}
+        self._next_events_time = 0
+        self._created_dirs = set()
+        self._existing_files = self._get_destination_files()
+        try:
+            with ThreadPoolExecutor(self.copy_workers) as executor:
+                self._copy_executor = executor
+                self.model.foreach(self._sync_entry)
+                self._wait_for_copies()
+            self._copy_executor = None
+            if not self.running:
+                return False
+            self._remove_empty_dirs()
+            return True
+        finally:
+            # Don't leave a queued summary update behind
+            self._update_sync_summary()
 
     def _sync_entry(self, model, path, iter_, *data):
         """
@@ -1007,7 +1250,11 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
         if not self.running:
             print_d(_('Stopped song synchronization'))
             return True
-        self._run_pending_events()
+        # Deletions and existence checks can be slow on some devices, so
+        # keep the application responsive based on the elapsed time
+        if time.monotonic() >= self._next_events_time:
+            self._run_pending_events()
+            self._next_events_time = time.monotonic() + self.events_interval
         if not self.destination_entry.get_text():
             print_d(_('A different plugin was selected - stop synchronization'))
             return True
@@ -1021,7 +1268,7 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
         if entry.tag == Entry.Tags.PENDING_COPY:
             # Export, skipping existing files
             expanded_path = os.path.expanduser(entry.export_path)
-            if os.path.exists(expanded_path):
+            if self._destination_exists(expanded_path):
                 entry.tag = Entry.Tags.RESULT_SKIP_EXISTING
                 self._update_model_value(iter_, 'tag', entry.tag)
                 self.c_files_skip += 1
@@ -1030,18 +1277,17 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
                 self._update_model_value(iter_, 'tag', entry.tag)
 
                 song_folders = os.path.dirname(expanded_path)
-                os.makedirs(song_folders, exist_ok=True)
-                try:
-                    shutil.copyfile(entry.filename, expanded_path)
-                except Exception as ex:
-                    entry.tag = Entry.Tags.RESULT_FAILURE + ': ' + str(ex)
-                    self._update_model_value(iter_, 'tag', entry.tag)
-                    print_exc()
-                    self.c_files_failed += 1
-                else:
-                    entry.tag = Entry.Tags.RESULT_SUCCESS
-                    self._update_model_value(iter_, 'tag', entry.tag)
-                    self.c_files_copy += 1
+                if song_folders not in self._created_dirs:
+                    os.makedirs(song_folders, exist_ok=True)
+                    self._created_dirs.add(song_folders)
+                future = self._copy_executor.submit(
+                    _copy_file, entry.filename, expanded_path)
+                self._copy_futures[future] = (entry, iter_.copy())
+                # Skip any later entry with the same path, even before this
+                # copy has created the file
+                self._existing_files.add(expanded_path)
+                self._copy_targets[self._copy_target_key(expanded_path)] = \
+                    future
 
         elif entry.tag == Entry.Tags.SKIP_DUPLICATE:
             self.c_files_dupes += 1
@@ -1066,25 +1312,112 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
         else:
             self.c_files_skip_previous += 1
 
-        self._update_sync_summary()
+        self._queue_sync_summary()
         return False
 
+    def _destination_exists(self, path):
+        """
+        Check whether a file already exists in the destination, or will once
+        the started copies have finished.
+
+        :param path: The expanded export path of a song.
+        :return: Whether the file exists.
+        """
+        if path in self._existing_files:
+            return True
+
+        # On e.g. FAT devices, a path differing only in case or Unicode
+        # normalization is the same file, so let an earlier copy to it finish
+        earlier_copy = self._copy_targets.get(self._copy_target_key(path))
+        if earlier_copy is not None:
+            wait([earlier_copy])
+
+        # The listing doesn't follow symlinked folders and is case-sensitive,
+        # so let the file system confirm any misses
+        return os.path.exists(path)
+
+    @staticmethod
+    def _copy_target_key(path):
+        """
+        Get a key which is the same for all paths that a case-insensitive or
+        normalizing file system may treat as the same file.
+
+        :param path: An expanded export path.
+        """
+        return unicodedata.normalize(
+            'NFC', os.path.normcase(path)).casefold()
+
+    def _wait_for_copies(self):
+        """
+        Wait for all started file copies to finish, keeping the application
+        responsive. Copies that haven't started yet are cancelled if the
+        synchronization is stopped.
+        """
+        futures = self._copy_futures
+        while futures:
+            if not self.running or not self.destination_entry.get_text():
+                for future, (entry, iter_) in list(futures.items()):
+                    if future.cancel():
+                        entry.tag = Entry.Tags.PENDING_COPY
+                        self._update_model_value(iter_, 'tag', entry.tag)
+                        del futures[future]
+
+            done, __ = wait(futures, timeout=0.1,
+                            return_when=FIRST_COMPLETED)
+            for future in done:
+                entry, iter_ = futures.pop(future)
+                self._finish_copy(future, entry, iter_)
+            self._run_pending_events()
+
+    def _finish_copy(self, future, entry, iter_):
+        """
+        Update the status of a song once its file copy has completed.
+
+        :param future: The completed Future of the file copy.
+        :param entry:  The Entry of the copied song.
+        :param iter_:  A Gtk.TreeIter for the row of the copied song.
+        """
+        try:
+            future.result()
+        except Exception as ex:
+            entry.tag = Entry.Tags.RESULT_FAILURE + ': ' + str(ex)
+            self._update_model_value(iter_, 'tag', entry.tag)
+            print_exc()
+            self.c_files_failed += 1
+        else:
+            entry.tag = Entry.Tags.RESULT_SUCCESS
+            self._update_model_value(iter_, 'tag', entry.tag)
+            self.c_files_copy += 1
+        self._queue_sync_summary()
+
     def _remove_empty_dirs(self):
         """
         Delete all empty sub-directories from the given path.
-        """
-        for root, dirs, __ in os.walk(self.expanded_destination, topdown=False):
-            for dirname in dirs:
-                dir_path = os.path.realpath(os.path.join(root, dirname))
-                if not os.listdir(dir_path):
+        Directories are removed one level at a time, deepest first, so that
+        parents emptied by removing their children are removed in the next
+        pass.
+        """
+        levels = {}
+        self._collect_dirs(self.expanded_destination, 0, levels)
+
+        with ThreadPoolExecutor(self.remove_workers) as executor:
+            for depth in sorted(levels, reverse=True):
+                removals = {}
+                for dir_path in levels[depth]:
+                    if not self._is_empty_dir(dir_path):
+                        continue
                     entry = Entry(None)
                     entry.filename = dir_path
                     entry.tag = Entry.Tags.IN_PROGRESS_DELETE
                     iter_ = self.model.append(row=self._make_model_row(entry))
                     print_d(_('Removing "{}"').format(entry.filename))
                     self.c_songs_delete += 1
+                    future = executor.submit(os.rmdir, dir_path)
+                    removals[future] = (entry, iter_)
+
+                for future, (entry, iter_) in removals.items():
                     try:
-                        os.rmdir(dir_path)
+                        future.result()
                     except Exception as ex:
                         entry.tag = Entry.Tags.RESULT_FAILURE + ': ' + str(ex)
                         self._update_model_value(iter_, 'tag', entry.tag)
@@ -1094,12 +1427,60 @@ class SyncToDevice(EventPlugin, PluginConfigMixin):
                         entry.tag = Entry.Tags.RESULT_SUCCESS
                         self._update_model_value(iter_, 'tag', entry.tag)
                         self.c_files_delete += 1
-                    self._update_sync_summary()
+                    self._queue_sync_summary()
+
+    def _collect_dirs(self, path, depth, levels):
+        """
+        Find all sub-directories of a path, without following symlinks.
+
+        :param path:   The path to search.
+        :param depth:  The depth of the sub-directories of the path.
+        :param levels: A dictionary of depths to lists of directory paths,
+                       to which the sub-directories are added.
+        """
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        levels.setdefault(depth, []).append(entry.path)
+                        self._collect_dirs(entry.path, depth + 1, levels)
+        except OSError:
+            # Like os.walk(), skip directories that can't be read
+            pass
+
+    @staticmethod
+    def _is_empty_dir(path):
+        """
+        Check whether a directory is empty, without listing all its contents.
+
+        :param path: The path of the directory.
+        :return: Whether the directory has no entries.
+        """
+        with os.scandir(path) as it:
+            return next(it, None) is None
+
+    def _queue_sync_summary(self):
+        """
+        Update the synchronization summary text field once the main loop is
+        idle, so that many changes in a row only update it once.
+        """
+        if not self._sync_summary_queued:
+            self._sync_summary_queued = True
+            GLib.idle_add(self._flush_sync_summary)
+
+    def _flush_sync_summary(self):
+        """
+        Run a queued update of the synchronization summary text field.
+        """
+        if self._sync_summary_queued:
+            self._update_sync_summary()
+        return False
 
     def _update_sync_summary(self):
         """
         Update the synchronization summary text field.
         """
+        self._sync_summary_queued = False
         sync_summary_prefix = _('Synchronization has:') + self.summary_sep
         sync_summary = []
 
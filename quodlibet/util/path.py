@@ -296,6 +296,10 @@ def get_temp_cover_file(data):
         return fn
 
 
+_win32_incompat_tables = {}
+_WIN32_INCOMPAT_END = re.compile(r'[\. ]$')
+
+
 def _strip_win32_incompat(string, BAD=r'\:*?;"<>|'):
     """Strip Win32-incompatible characters from a Windows or Unix path."""
 
@@ -305,13 +309,15 @@ def _strip_win32_incompat(string, BAD=r'\:*?;"<>|'):
     if not string:
         return string
 
-    new = "".join((s in BAD and "_") or s
-                  for s in string)
-    parts = new.split(os.sep)
+    table = _win32_incompat_tables.get(BAD)
+    if table is None:
+        table = str.maketrans(dict.fromkeys(BAD, "_"))
+        _win32_incompat_tables[BAD] = table
 
-    def fix_end(string):
-        return re.sub(r'[\. ]$', "_", string)
-    return os.sep.join(fix_end(p)
+    new = string.translate(table)
+    parts = new.split(os.sep)
+    fix_end = _WIN32_INCOMPAT_END.sub
+    return os.sep.join(fix_end("_", p)
                        for p in parts)
 
 
@@ -0,0 +1,172 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import importlib.util
+import os
+import shutil
+import sys
+from unittest.mock import patch
+
+import quodlibet
+from quodlibet import app
+from quodlibet import config
+from quodlibet.formats import AudioFile
+from quodlibet.library import SongLibrary
+from quodlibet.util import get_module_dir
+
+from tests import mkdtemp, skipUnless
+from . import PluginTestCase, modules
+
+QL_DIR = get_module_dir(quodlibet)
+QLDATA_DIR = os.path.join(os.path.dirname(QL_DIR), "data")
+INI_NAME = "io.github.quodlibet.QuodLibet-search-provider.ini"
+
+
+def _load_searchprovider():
+    """The plugin only imports if GNOME Shell knows about Quod Libet, so
+    import it with the search provider file from the source tree.
+    """
+
+    if os.name == "nt" or sys.platform == "darwin":
+        return None
+    ini_path = os.path.join(QLDATA_DIR, INI_NAME)
+    if not os.path.exists(ini_path):
+        return None
+
+    data_dir = mkdtemp()
+    try:
+        provider_dir = os.path.join(
+            data_dir, "gnome-shell", "search-providers")
+        os.makedirs(provider_dir)
+        shutil.copy(ini_path, provider_dir)
+
+        path = os.path.join(QL_DIR, "ext", "events", "searchprovider.py")
+        spec = importlib.util.spec_from_file_location(
+            "test_searchprovider_plugin", path)
+        module = importlib.util.module_from_spec(spec)
+        with patch.dict(os.environ, {"XDG_DATA_DIRS": data_dir}):
+            spec.loader.exec_module(module)
+        return module
+    finally:
+        shutil.rmtree(data_dir)
+
+
+searchprovider = modules.get("searchprovider") or _load_searchprovider()
+
+
+def _song(name):
+    return AudioFile({"~filename": "/dev/null/" + name,
+                      "title": name, "artist": "Artist"})
+
+
+@skipUnless(searchprovider, "searchprovider plugin not supported")
+class TSearchProvider(PluginTestCase):
+
+    def setUp(self):
+        config.init()
+        self.old_library = app.library
+        app.library = SongLibrary()
+        self.songs = [_song("Song1"), _song("Song2"), _song("Song3")]
+        app.library.add(self.songs)
+
+        with patch.object(searchprovider.Gio, "bus_own_name",
+                          return_value=None):
+            self.provider = searchprovider.SearchProvider()
+
+    def tearDown(self):
+        self.provider.remove_from_connection()
+        app.library.destroy()
+        app.library = self.old_library
+        config.quit()
+
+    def _ids(self, songs):
+        return [searchprovider.get_song_id(s) for s in songs]
+
+    def _names(self, metas):
+        return [meta["name"].unpack() for meta in metas]
+
+    def test_get_songs_for_ids(self):
+        songs_by_id = searchprovider.get_songs_by_id(self.songs)
+        song1, song2, song3 = self.songs
+        ids = [self._ids([song3])[0], "foo", "", "12abc", "-",
+               self._ids([song1])[0], str(id(self)), "1.5"]
+        self.assertEqual(
+            searchprovider.get_songs_for_ids(songs_by_id, ids),
+            [song3, song1])
+        self.assertEqual(searchprovider.get_songs_for_ids(songs_by_id, []),
+                         [])
+
+    def test_lookup(self):
+        ids = self._ids(self.songs)
+        self.assertEqual(self.provider._get_songs_for_ids(ids), self.songs)
+        self.assertEqual(
+            self.provider.GetSubsearchResultSet(ids, ["Song2"]), ids[1:2])
+
+    def test_lookup_added(self):
+        new_song = _song("Song4")
+        new_id = self._ids([new_song])
+        self.assertEqual(self.provider._get_songs_for_ids(new_id), [])
+
+        app.library.add([new_song])
+        self.assertEqual(self.provider._get_songs_for_ids(new_id),
+                         [new_song])
+
+    def test_lookup_removed(self):
+        song_id = self._ids(self.songs[:1])
+        self.assertEqual(self.provider._get_songs_for_ids(song_id),
+                         self.songs[:1])
+
+        app.library.remove(self.songs[:1])
+        self.assertEqual(self.provider._get_songs_for_ids(song_id), [])
+        self.assertEqual(self.provider.GetResultMetas(song_id), [])
+
+    def test_metas_cached(self):
+        ids = self._ids(self.songs)
+        metas = self.provider.GetResultMetas(ids)
+        self.assertEqual(self._names(metas), ["Song1", "Song2", "Song3"])
+        self.assertEqual([m["id"].unpack() for m in metas], ids)
+        for old, new in zip(metas, self.provider.GetResultMetas(ids)):
+            self.assertIs(old, new)
+
+    def test_metas_changed(self):
+        song = self.songs[0]
+        song_id = self._ids([song])
+        old_meta = self.provider.GetResultMetas(song_id)[0]
+
+        song["title"] = "Changed"
+        app.library.changed([song])
+        new_meta = self.provider.GetResultMetas(song_id)[0]
+        self.assertIsNot(new_meta, old_meta)
+        self.assertEqual(self._names([new_meta]), ["Changed"])
+
+        # Metas of other songs are kept
+        other_ids = self._ids(self.songs[1:])
+        other_metas = self.provider.GetResultMetas(other_ids)
+        song["title"] = "Changed again"
+        app.library.changed([song])
+        for old, new in zip(other_metas,
+                            self.provider.GetResultMetas(other_ids)):
+            self.assertIs(old, new)
+
+    def test_metas_added(self):
+        ids = self._ids(self.songs)
+        metas = self.provider.GetResultMetas(ids)
+
+        app.library.add([_song("Song4")])
+        new_metas = self.provider.GetResultMetas(ids)
+        self.assertEqual(self._names(new_metas), self._names(metas))
+        self.assertIsNot(new_metas[0], metas[0])
+
+    def test_metas_eviction(self):
+        self.provider.MAX_CACHED_METAS = 2
+        ids = self._ids(self.songs)
+
+        metas = self.provider.GetResultMetas(ids)
+        self.assertEqual(self._names(metas), ["Song1", "Song2", "Song3"])
+        self.assertLessEqual(len(self.provider._metas), 2)
+
+        metas = self.provider.GetResultMetas(ids)
+        self.assertEqual(self._names(metas), ["Song1", "Song2", "Song3"])
+        self.assertLessEqual(len(self.provider._metas), 2)
@@ -6,6 +6,8 @@
 # (at your option) any later version.
 
 import os
+import shutil
+import time
 from os import makedirs
 from pathlib import Path
 from unittest.mock import ANY, patch
@@ -19,19 +21,22 @@ from quodlibet import get_user_dir
 from quodlibet.formats import AudioFile
 from quodlibet.plugins import PM
 from quodlibet.qltk.ccb import ConfigCheckButton
+from quodlibet.query import Query
+from quodlibet.util import is_windows
 from quodlibet.util.path import strip_win32_incompat_from_path
+from tests import mkdtemp, skipIf, skipUnless
 from tests.plugin import PluginTestCase
 
 
 QUERIES = {
     'Directory': {'query': '~dirname="/dev/null"',
-                  'terms': ('/dev/null',), 'results': 5},
+                  'terms': ('/dev/null',), 'results': 5, 'dirs': 3},
     '2 artists': {'query': 'artist=|("Group1","Group2")',
-                  'terms': ('Group',), 'results': 4},
+                  'terms': ('Group',), 'results': 4, 'dirs': 2},
     'No songs': {'query': '#(length < 0)',
-                 'terms': (), 'results': 0},
+                 'terms': (), 'results': 0, 'dirs': 0},
     'Symbols': {'query': '~dirname="/tmp/new"',
-                'terms': ('/tmp/new',), 'results': 1}
+                'terms': ('/tmp/new',), 'results': 1, 'dirs': 1}
 }
 
 PATTERNS = [
@@ -283,6 +288,45 @@ class TSyncToDevice(PluginTestCase):
         self.assertTrue(self.plugin.sync_start_button.get_visible())
         self.assertFalse(self.plugin.sync_stop_button.get_visible())
 
+    def test_read_saved_queries_file_changed(self):
+        queries = self.plugin._read_saved_queries()
+        self.assertEqual(set(queries), set(QUERIES))
+        self.assertIs(self.plugin._read_saved_queries(), queries)
+
+        with open(self.plugin.path_query, 'a') as f:
+            f.write('\n#(added < 7 days)\nRecent')
+        queries = self.plugin._read_saved_queries()
+        self.assertEqual(set(queries), set(QUERIES) | {'Recent'})
+        self.assertEqual(queries['Recent'], '#(added < 7 days)')
+
+        with open(self.plugin.path_query, 'w') as f:
+            f.write(self.QUERIES_SAVED.replace('Directory', 'Folder'))
+        queries = self.plugin._read_saved_queries()
+        self.assertNotIn('Directory', queries)
+        self.assertEqual(queries['Folder'], QUERIES['Directory']['query'])
+
+    def test_compile_query_reused(self):
+        query = self.plugin._compile_query('artist=Artist1')
+        self.assertEqual(query.string, 'artist=Artist1')
+        self.assertIs(self.plugin._compile_query('artist=Artist1'), query)
+
+        self._make_library()
+        self._select_searches('Directory', '2 artists')
+        self.plugin._get_songs_from_queries()
+        compiled = dict(self.module.SyncToDevice._compiled_queries)
+        self.assertIn(QUERIES['Directory']['query'], compiled)
+        self.assertIn(QUERIES['2 artists']['query'], compiled)
+
+        self.plugin._get_songs_from_queries()
+        for query_string, query in compiled.items():
+            self.assertIs(self.plugin._compile_query(query_string), query)
+
+        # Re-reading a changed file compiles the queries again
+        with open(self.plugin.path_query, 'a') as f:
+            f.write('\n#(added < 7 days)\nRecent')
+        self.plugin._read_saved_queries()
+        self.assertEqual(self.module.SyncToDevice._compiled_queries, {})
+
     def test_select_saved_search(self):
         button = self.plugin.saved_search_vbox.get_children()[0]
 
@@ -484,6 +528,31 @@ class TSyncToDevice(PluginTestCase):
         self.plugin._start_preview(self.plugin.preview_start_button)
         self.plugin.model.foreach(_verify_path, self.path_dest)
 
+    def test_start_preview_dot_dot_tags(self):
+        app.library = library.init()
+        app.library.add([
+            AudioFile({'~filename': '/dev/null/Dots1.mp3',
+                       'title': 'Dots1', 'artist': '..', 'album': 'Album1'}),
+            AudioFile({'~filename': '/dev/null/Dots2.mp3',
+                       'title': 'Dots2', 'artist': 'Artist1', 'album': '..'})
+        ])
+
+        self._select_searches('Directory')
+        self.dest_entry.set_text(self.path_dest)
+        self.pattern_entry.set_text(str(Path('<artist>', '<album>',
+                                             '<title>')))
+
+        self.plugin._start_preview(self.plugin.preview_start_button)
+
+        export_col = self.plugin._model_col_id('export')
+        tag_col = self.plugin._model_col_id('tag')
+        export_paths = {row[export_col] for row in self.plugin.model}
+        self.assertEqual(export_paths, {
+            os.path.join(self.path_dest, '._', 'Album1', 'Dots1.mp3'),
+            os.path.join(self.path_dest, 'Artist1', '._', 'Dots2.mp3')})
+        for row in self.plugin.model:
+            self.assertEqual(row[tag_col], self.Tags.PENDING_COPY)
+
     def test_start_preview_file_deletion(self):
         self._make_library()
         num_files = self._make_files_for_deletion()
@@ -836,11 +905,12 @@ class TSyncToDevice(PluginTestCase):
         self.dest_entry.set_text(self.path_dest)
         self.plugin._start_preview(self.plugin.preview_start_button)
         n_songs = QUERIES[query_name]['results']
+        n_song_dirs = QUERIES[query_name]['dirs']
 
         self.plugin._start_sync(self.plugin.sync_start_button)
 
         self.assertEqual(self.plugin.c_files_copy, n_songs)
-        self.assertEqual(mock_mkdir.call_count, n_songs)
+        self.assertEqual(mock_mkdir.call_count, n_song_dirs)
         self.assertEqual(mock_cp.call_count, n_songs)
         self.assertEqual(mock_rm.call_count, 0)
         self.plugin.model.foreach(self._verify_child,
@@ -887,6 +957,7 @@ class TSyncToDevice(PluginTestCase):
         self.dest_entry.set_text(self.path_dest)
         self.plugin._start_preview(self.plugin.preview_start_button)
         n_songs = QUERIES[query_name]['results']
+        n_song_dirs = QUERIES[query_name]['dirs']
         self.assertTrue(self.plugin.status_deletions.get_visible())
 
         self.plugin._start_sync(self.plugin.sync_start_button)
@@ -894,7 +965,7 @@ class TSyncToDevice(PluginTestCase):
 
         self.assertEqual(self.plugin.c_files_copy, n_songs)
         self.assertEqual(self.plugin.c_files_delete, n_files)
-        self.assertEqual(mock_mkdir.call_count, n_songs)
+        self.assertEqual(mock_mkdir.call_count, n_song_dirs)
         self.assertEqual(mock_cp.call_count, n_songs)
         self.assertEqual(mock_rm.call_count, n_files)
         self.plugin.model.foreach(self._verify_child,
@@ -915,6 +986,7 @@ class TSyncToDevice(PluginTestCase):
         self.dest_entry.set_text(self.path_dest)
         self.plugin._start_preview(self.plugin.preview_start_button)
         n_songs = QUERIES[query_name]['results']
+        n_song_dirs = QUERIES[query_name]['dirs']
 
         self.plugin._start_sync(self.plugin.sync_start_button)
 
@@ -922,7 +994,7 @@ class TSyncToDevice(PluginTestCase):
         self.assertEqual(n_children_updated, n_songs + n_files + n_dirs)
         self.assertEqual(self.plugin.c_files_copy, n_songs)
         self.assertEqual(self.plugin.c_files_delete, n_files + n_dirs)
-        self.assertEqual(mkdir.call_count, n_songs)
+        self.assertEqual(mkdir.call_count, n_song_dirs)
         self.assertEqual(cp.call_count, n_songs)
         self.assertEqual(rm.call_count, n_files)
         self.assertEqual(rmdir.call_count, n_dirs)
@@ -941,6 +1013,7 @@ class TSyncToDevice(PluginTestCase):
         self.dest_entry.set_text(self.path_dest)
         self.plugin._start_preview(self.plugin.preview_start_button)
         n_songs = QUERIES[query_name]['results']
+        n_song_dirs = QUERIES[query_name]['dirs']
         n_total = n_songs + n_files
 
         n_children = self.plugin.model.iter_n_children(None)
@@ -949,7 +1022,7 @@ class TSyncToDevice(PluginTestCase):
         self.plugin._start_sync(self.plugin.sync_start_button)
 
         self.assertEqual(self.plugin.c_files_failed, n_total)
-        self.assertEqual(mock_mkdir.call_count, n_songs)
+        self.assertEqual(mock_mkdir.call_count, n_song_dirs)
         self.assertEqual(mock_cp.call_count, n_songs)
         self.assertEqual(mock_rm.call_count, n_files)
         self.plugin.model.foreach(self._verify_child,
@@ -992,7 +1065,7 @@ class TSyncToDevice(PluginTestCase):
         self.assertEqual(self.plugin.c_files_skip, n_songs_existing)
         self.assertEqual(self.plugin.c_files_dupes, n_songs_duplicate)
         self.assertEqual(self.plugin.c_files_delete, n_files + n_dirs)
-        self.assertEqual(mkdir.call_count, n_expected_songs)
+        self.assertEqual(mkdir.call_count, 1)
         self.assertEqual(cp.call_count, n_expected_songs)
         self.assertEqual(rm.call_count, n_files)
         self.assertEqual(rmdir.call_count, n_dirs)
@@ -1011,10 +1084,11 @@ class TSyncToDevice(PluginTestCase):
         self.dest_entry.set_text(self.path_dest)
         self.plugin._start_preview(self.plugin.preview_start_button)
         n_songs = QUERIES[query_name]['results']
+        n_song_dirs = QUERIES[query_name]['dirs']
 
         self.plugin._start_sync(self.plugin.sync_start_button)
         self.assertEqual(self.plugin.c_files_copy, n_songs)
-        self.assertEqual(mock_mkdir.call_count, n_songs)
+        self.assertEqual(mock_mkdir.call_count, n_song_dirs)
         self.assertEqual(mock_cp.call_count, n_songs)
         self.assertEqual(mock_rm.call_count, 0)
 
@@ -1037,11 +1111,12 @@ class TSyncToDevice(PluginTestCase):
         self._select_searches(query_name)
         self.dest_entry.set_text(self.path_dest)
         n_songs = QUERIES[query_name]['results']
+        n_song_dirs = QUERIES[query_name]['dirs']
 
         self.plugin._start_preview(self.plugin.preview_start_button)
         self.plugin._start_sync(self.plugin.sync_start_button)
         self.assertEqual(self.plugin.c_files_copy, n_songs)
-        self.assertEqual(mock_mkdir.call_count, n_songs)
+        self.assertEqual(mock_mkdir.call_count, n_song_dirs)
         self.assertEqual(mock_cp.call_count, n_songs)
         self.assertEqual(mock_rm.call_count, 0)
 
@@ -1052,6 +1127,207 @@ class TSyncToDevice(PluginTestCase):
         self.plugin._start_preview(self.plugin.preview_start_button)
         self.plugin._start_sync(self.plugin.sync_start_button)
         self.assertEqual(self.plugin.c_files_copy, n_songs)
-        self.assertEqual(mock_mkdir.call_count, n_songs)
+        self.assertEqual(mock_mkdir.call_count, n_song_dirs)
         self.assertEqual(mock_cp.call_count, n_songs)
         self.assertEqual(mock_rm.call_count, 0)
+
+    @patch('shutil.copyfile')
+    @patch('os.makedirs')
+    def test_start_sync_same_export_path(self, mock_mkdir, mock_cp):
+        self._make_library()
+        query_name = 'Directory'
+        self._select_searches(query_name)
+        self.dest_entry.set_text(self.path_dest)
+        n_songs = QUERIES[query_name]['results']
+
+        self.plugin._start_preview(self.plugin.preview_start_button)
+        entry_col = self.plugin._model_col_id('entry')
+        first = self.plugin.model[0][entry_col]
+        second = self.plugin.model[1][entry_col]
+        second.export_path = first.export_path
+
+        self.plugin._start_sync(self.plugin.sync_start_button)
+        self.assertEqual(self.plugin.c_files_skip, 1)
+        self.assertEqual(self.plugin.c_files_copy, n_songs - 1)
+        self.assertEqual(mock_cp.call_count, n_songs - 1)
+
+    @patch('os.makedirs')
+    def test_start_sync_export_paths_differ_in_case(self, mock_mkdir):
+        copies = {}
+
+        def _copy(src, dst):
+            start = time.monotonic()
+            time.sleep(0.05)
+            copies[dst] = (start, time.monotonic())
+
+        self._make_library()
+        self._select_searches('Directory')
+        self.dest_entry.set_text(self.path_dest)
+
+        self.plugin._start_preview(self.plugin.preview_start_button)
+        entry_col = self.plugin._model_col_id('entry')
+        first = self.plugin.model[0][entry_col]
+        second = self.plugin.model[1][entry_col]
+        dirname, basename = os.path.split(first.export_path)
+        second.export_path = os.path.join(dirname, basename.swapcase())
+
+        with patch('shutil.copyfile', side_effect=_copy):
+            self.plugin._start_sync(self.plugin.sync_start_button)
+
+        # The copies may write the same file, so they must not overlap
+        first_copy = copies[os.path.expanduser(first.export_path)]
+        second_copy = copies[os.path.expanduser(second.export_path)]
+        self.assertGreaterEqual(second_copy[0], first_copy[1])
+
+    @skipIf(is_windows(), "no symlink")
+    @patch('shutil.copyfile')
+    @patch('os.makedirs')
+    def test_start_sync_existing_file_in_symlinked_folder(self, mock_mkdir,
+                                                          mock_cp):
+        self._make_library()
+        query_name = 'Directory'
+        self._select_searches(query_name)
+        self.dest_entry.set_text(self.path_dest)
+        self.pattern_entry.set_text(str(Path('<artist>', '<album>',
+                                             '<title>')))
+        n_songs = QUERIES[query_name]['results']
+
+        target_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, target_dir)
+        os.mkdir(os.path.join(target_dir, 'Album1'))
+        with open(os.path.join(target_dir, 'Album1', 'Song1.mp3'), 'w'):
+            pass
+        artist_dir = os.path.join(self.path_dest, 'Artist1')
+        os.symlink(target_dir, artist_dir)
+        try:
+            self.plugin._start_preview(self.plugin.preview_start_button)
+            self.assertEqual(self.plugin.c_songs_delete, 0)
+
+            self.plugin._start_sync(self.plugin.sync_start_button)
+            self.assertTrue(os.path.isdir(os.path.join(target_dir, 'Album1')))
+        finally:
+            os.remove(artist_dir)
+
+        self.assertEqual(self.plugin.c_files_skip, 1)
+        self.assertEqual(self.plugin.c_files_copy, n_songs - 1)
+        self.assertEqual(mock_cp.call_count, n_songs - 1)
+
+    @skipIf(is_windows(), "no symlink")
+    def test_remove_empty_dirs(self):
+        def _path(*parts):
+            return os.path.join(self.path_dest, *parts)
+
+        os.makedirs(_path('a', 'b', 'c'))
+        os.makedirs(_path('d', 'e'))
+        with open(_path('d', 'keep.txt'), 'w'):
+            pass
+        os.mkdir(_path('f'))
+        target_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, target_dir)
+        os.mkdir(os.path.join(target_dir, 'sub'))
+        os.symlink(target_dir, _path('f', 'link'))
+
+        self.plugin.model.clear()
+        self.plugin.expanded_destination = self.path_dest
+        self.plugin.c_files_copy = self.plugin.c_files_skip \
+            = self.plugin.c_files_skip_previous = self.plugin.c_files_dupes \
+            = self.plugin.c_files_delete = self.plugin.c_files_failed \
+            = self.plugin.c_songs_delete = 0
+        try:
+            self.plugin._remove_empty_dirs()
+            self.plugin._update_sync_summary()
+
+            self.assertFalse(os.path.exists(_path('a')))
+            self.assertFalse(os.path.exists(_path('d', 'e')))
+            self.assertTrue(os.path.isfile(_path('d', 'keep.txt')))
+            self.assertTrue(os.path.islink(_path('f', 'link')))
+            self.assertTrue(os.path.isdir(os.path.join(target_dir, 'sub')))
+        finally:
+            os.remove(_path('f', 'link'))
+
+        self.assertEqual(self.plugin.c_files_delete, 4)
+        self.assertEqual(self.plugin.c_files_failed, 0)
+        removed = [row[self.plugin._model_col_id('filename')]
+                   for row in self.plugin.model]
+        self.assertCountEqual(removed, [_path('a', 'b', 'c'), _path('a', 'b'),
+                                        _path('d', 'e'), _path('a')])
+        # Deepest first, so that emptied parents go in the same call
+        self.assertLess(removed.index(_path('a', 'b', 'c')),
+                        removed.index(_path('a', 'b')))
+        self.assertLess(removed.index(_path('a', 'b')),
+                        removed.index(_path('a')))
+        for row in self.plugin.model:
+            self.assertEqual(row[self.plugin._model_col_id('tag')],
+                             self.Tags.RESULT_SUCCESS)
+
+    def test_selected_songs_cache(self):
+        self._make_library()
+        self._select_searches('Directory')
+        self.plugin.enabled()
+        self.addCleanup(self.plugin.disabled)
+        n_songs = QUERIES['Directory']['results']
+
+        songs = self.plugin._get_songs_from_queries()
+        self.assertEqual(len(songs), n_songs)
+        self.assertIs(self.plugin._get_songs_from_queries(), songs)
+
+        new_song = AudioFile({'~filename': '/dev/null/Song6.mp3',
+                              'title': 'Song6', 'artist': 'Artist2',
+                              'album': 'Album2'})
+        app.library.add([new_song])
+        self.plugin.plugin_on_added([new_song])
+        songs = self.plugin._get_songs_from_queries()
+        self.assertEqual(len(songs), n_songs + 1)
+        self.assertIn(new_song, songs)
+
+        new_song['title'] = 'Song7'
+        app.library.changed([new_song])
+        self.plugin.plugin_on_changed([new_song])
+        self.assertIsNot(self.plugin._get_songs_from_queries(), songs)
+
+        app.library.remove([new_song])
+        self.plugin.plugin_on_removed([new_song])
+        songs = self.plugin._get_songs_from_queries()
+        self.assertEqual(len(songs), n_songs)
+        self.assertNotIn(new_song, songs)
+
+        # A different library is never served from the cache
+        self._make_library()
+        self.assertIsNot(self.plugin._get_songs_from_queries(), songs)
+
+    def test_selected_songs_not_cached_when_disabled(self):
+        self._make_library()
+        self._select_searches('Directory')
+
+        songs = self.plugin._get_songs_from_queries()
+        self.assertIsNot(self.plugin._get_songs_from_queries(), songs)
+
+    def test_selected_songs_depends_on_time(self):
+        self.assertTrue(
+            self.plugin._depends_on_time(Query('#(added < 7 days)')))
+        self.assertTrue(
+            self.plugin._depends_on_time(Query('#(lastplayed < 2 weeks)')))
+        self.assertFalse(
+            self.plugin._depends_on_time(Query('artist=Artist1')))
+
+    def _copy_temp_file(self):
+        temp_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        src = os.path.join(temp_dir, 'src.mp3')
+        dst = os.path.join(temp_dir, 'dst.mp3')
+        data = os.urandom(100000)
+        with open(src, 'wb') as f:
+            f.write(data)
+
+        self.module._copy_file(src, dst)
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_copy_file(self):
+        self._copy_temp_file()
+
+    @skipUnless(hasattr(os, 'copy_file_range'), 'no os.copy_file_range')
+    def test_copy_file_range_copies_nothing(self):
+        with patch('os.copy_file_range', return_value=0) as mock_copy:
+            self._copy_temp_file()
+        self.assertEqual(mock_copy.call_count, 1)
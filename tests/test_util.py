@@ -28,7 +28,8 @@ from quodlibet.util.path import fsn2glib, glib2fsn, \
     parse_xdg_user_dirs, xdg_get_system_data_dirs, escape_filename, \
     strip_win32_incompat_from_path, xdg_get_cache_home, \
     xdg_get_data_home, unexpand, expanduser, xdg_get_user_dirs, \
-    xdg_get_config_home, get_temp_cover_file, mkdir, mtime
+    xdg_get_config_home, get_temp_cover_file, mkdir, mtime, \
+    _strip_win32_incompat
 from quodlibet.util.string import decode, encode, split_escape, join_escape
 
 from . import TestCase, skipIf
@@ -781,6 +782,32 @@ class Tstrip_win32_incompat_from_path(TestCase):
             self.assertEqual(v, "/foo/__a")
 
 
+class T_strip_win32_incompat(TestCase):
+
+    def test_custom_bad(self):
+        self.assertEqual(_strip_win32_incompat("a-b+c", BAD="-+"), "a_b_c")
+        self.assertEqual(_strip_win32_incompat("a<b?", BAD="-"), "a<b?")
+        self.assertEqual(_strip_win32_incompat("a<b?"), "a_b_")
+
+    def test_trailing_dot_or_space(self):
+        self.assertEqual(_strip_win32_incompat("foo."), "foo_")
+        self.assertEqual(_strip_win32_incompat("foo "), "foo_")
+        self.assertEqual(_strip_win32_incompat(".."), "._")
+        self.assertEqual(_strip_win32_incompat("a.b c"), "a.b c")
+        self.assertEqual(_strip_win32_incompat(""), "")
+
+        path = os.sep.join(["a.", "b ", "c"])
+        self.assertEqual(_strip_win32_incompat(path),
+                         os.sep.join(["a_", "b_", "c"]))
+
+    def test_repeated_calls(self):
+        for i in range(2):
+            self.assertEqual(_strip_win32_incompat("a?b."), "a_b_")
+            self.assertEqual(_strip_win32_incompat("a?b", BAD="b"), "a?_")
+            self.assertEqual(_strip_win32_incompat("a?b", BAD="?"), "a_b")
+            self.assertEqual(_strip_win32_incompat("c*d "), "c_d_")
+
+
 class TPathHandling(TestCase):
 
     def test_main(self):